@@ -9,6 +9,10 @@ import tensorflow as tf
 import logging
 import numpy as np
 import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from flask import Flask
 from flask import request
 from flask import render_template
@@ -29,24 +33,25 @@ logging.getLogger('tensorflow').setLevel(logging.FATAL)
 physical_devices = tf.config.list_physical_devices('GPU')
 tf.config.experimental.set_visible_devices(physical_devices[0], 'GPU')
 tf.config.experimental.set_memory_growth(physical_devices[0], enable=True)
+# Uses float16 computations with float32 variables for the inference of the encoder-decoder model on the GPU.
+tf.keras.mixed_precision.set_global_policy('mixed_float16')
 
 app = Flask(__name__)
 app_root_directory = os.path.dirname(os.path.abspath(__file__))
+# Queue of uploaded image paths and the futures for their captions, which are predicted in batches by the worker.
+caption_requests = queue.Queue()
+# Time in seconds for which an upload waits for its predicted caption.
+caption_request_timeout = 120
 
 
-def preprocess_image(image_path: str,
-                     model: tf.keras.Model) -> np.ndarray:
-    """Pre-processes the given image to extract features.
-
-    Reads the image, pre-processes it, and uses the pre-trained InceptionV3 to extract features from the
-    pre-processed image.
+def preprocess_image(image_path: str) -> tf.Tensor:
+    """Reads the given image, and pre-processes it based on the InceptionV3 input requirements.
 
     Args:
         image_path: Path to the image that should be read.
-        model: The pre-trained InceptionV3 model used to extract features from the image.
 
     Returns:
-        The features extracted from the image using the pre-trained InceptionV3 model.
+        The pre-processed image of shape (299, 299, 3).
     """
     # Reads image using the file name
     image = tf.io.read_file(image_path)
@@ -55,11 +60,23 @@ def preprocess_image(image_path: str,
     image = tf.image.resize(image, (299, 299))
     # Pre-processes the resized image based on InceptionV3 input requirements.
     image = tf.keras.applications.inception_v3.preprocess_input(image)
-    image = tf.convert_to_tensor([image])
-    # Extracts features from the pre-processed image using the pre-trained InceptionV3 model.
-    image = model(image)
-    image = tf.reshape(image, [image.shape[0], -1, image.shape[3]])
-    return image.numpy()
+    return image
+
+
+def extract_image_features(images: tf.Tensor,
+                           model: tf.keras.Model) -> tf.Tensor:
+    """Extracts features from the batch of pre-processed images using the pre-trained InceptionV3 model in a single
+    call.
+
+    Args:
+        images: The batch of pre-processed images of shape (batch_size, 299, 299, 3).
+        model: The pre-trained InceptionV3 model used to extract features from the images.
+
+    Returns:
+        The features extracted from the images using the pre-trained InceptionV3 model.
+    """
+    image_features = model(images)
+    return tf.reshape(image_features, [tf.shape(image_features)[0], -1, image_features.shape[3]])
 
 
 def load_json_file(directory_path: str,
@@ -76,10 +93,15 @@ def load_json_file(directory_path: str,
     file_path = '{}/{}.json'.format(directory_path, file_name)
     with open(file_path, 'r') as out_file:
         captions = json.load(out_file)
-    out_file.close()
     return captions
 
 
+# Decoder classes for each attention and model number.
+decoders = {('bahdanau_attention', 1): BahdanauDecoder1, ('bahdanau_attention', 2): BahdanauDecoder2,
+            ('bahdanau_attention', 3): BahdanauDecoder3, ('luong_attention', 1): LuongDecoder1,
+            ('luong_attention', 2): LuongDecoder2, ('luong_attention', 3): LuongDecoder3}
+
+
 def choose_encoder_decoder(parameters) -> tuple:
     """Uses attention and model number keys in the parameters, chooses the encoder and decoder model.
 
@@ -90,66 +112,212 @@ def choose_encoder_decoder(parameters) -> tuple:
          A tuple which contains the objects for the encoder and decoder models
     """
     encoder = Encoder(parameters['embedding_size'], parameters['dropout_rate'])
-    if parameters['attention'] == 'bahdanau_attention' and parameters['model_number'] == 1:
-        decoder = BahdanauDecoder1(parameters['embedding_size'], parameters['rnn_size'],
-                                   parameters['target_vocab_size'], parameters['dropout_rate'])
-    elif parameters['attention'] == 'bahdanau_attention' and parameters['model_number'] == 2:
-        decoder = BahdanauDecoder2(parameters['embedding_size'], parameters['rnn_size'],
-                                   parameters['target_vocab_size'], parameters['dropout_rate'])
-    elif parameters['attention'] == 'bahdanau_attention' and parameters['model_number'] == 3:
-        decoder = BahdanauDecoder3(parameters['embedding_size'], parameters['rnn_size'],
-                                   parameters['target_vocab_size'], parameters['dropout_rate'])
-    elif parameters['attention'] == 'luong_attention' and parameters['model_number'] == 1:
-        decoder = LuongDecoder1(parameters['embedding_size'], parameters['rnn_size'], parameters['dropout_rate'],
-                                parameters['target_vocab_size'])
-    elif parameters['attention'] == 'luong_attention' and parameters['model_number'] == 2:
-        decoder = LuongDecoder2(parameters['embedding_size'], parameters['rnn_size'], parameters['dropout_rate'],
-                                parameters['target_vocab_size'])
-    elif parameters['attention'] == 'luong_attention' and parameters['model_number'] == 3:
-        decoder = LuongDecoder3(parameters['embedding_size'], parameters['rnn_size'], parameters['dropout_rate'],
-                                parameters['target_vocab_size'])
+    # Passes the arguments by keyword, as the order of the arguments differs between the Bahdanau and Luong decoders.
+    decoder = decoders[(parameters['attention'], parameters['model_number'])](
+        embedding_size=parameters['embedding_size'], rnn_size=parameters['rnn_size'],
+        dropout_rate=parameters['dropout_rate'], target_vocab_size=parameters['target_vocab_size'])
     return encoder, decoder
 
 
-def predict_caption(image_features: tf.Tensor,
-                    parameters: dict,
-                    captions_tokenizer: tfds.deprecated.text.SubwordTextEncoder) -> str:
-    """Predicts caption for the current image's extracted features using the current model configuration.
+def build_encoder_decoder(encoder: tf.keras.Model,
+                          decoder: tf.keras.Model,
+                          parameters: dict) -> None:
+    """Passes zero inputs through the encoder-decoder model once, so that all the variables are created and restored
+    from the checkpoint.
 
     Args:
-        image_features: The features extracted for the current image using the pre-trained InceptionV3 model.
+        encoder: The encoder model for the current model configuration.
+        decoder: The decoder model for the current model configuration.
         parameters: A dictionary which contains current model configuration details.
-        captions_tokenizer: A TFDS tokenizer trained on the captions in the trained dataset.
 
     Returns:
-        A string which contains the predicted caption for the current image.
+        None.
+    """
+    encoder_out = encoder(tf.zeros((1, 64, 2048)), False)
+    encoder_out_projected = decoder.precompute_attention(encoder_out)
+    decoder_hidden_states = decoder.initialize_hidden_states(1, parameters['rnn_size'])
+    decoder_input = tf.fill([1, 1], parameters['start_token_index'])
+    decoder(decoder_input, decoder_hidden_states, encoder_out, encoder_out_projected, False)
+
+
+def restore_encoder_decoder(parameters: dict) -> tuple:
+    """Chooses the encoder and decoder based on the parameter configuration, and restores the last saved checkpoint.
+
+    Args:
+        parameters: A dictionary which contains current model configuration details.
+
+    Returns:
+        A tuple which contains the objects for the restored encoder and decoder models.
     """
-    # Chooses the encoder and decoder based on the parameter configuration.
     encoder, decoder = choose_encoder_decoder(parameters)
-    predicted_caption_indexes = []
     # Creates checkpoint for the encoder-decoder model and restores the last saved checkpoint.
     model_directory_path = 'results/{}/model_{}'.format(parameters['attention'], parameters['model_number'])
     checkpoint_directory = '{}/checkpoints'.format(model_directory_path)
+    latest_checkpoint = tf.train.latest_checkpoint(checkpoint_directory)
+    if latest_checkpoint is None:
+        raise FileNotFoundError('No checkpoint found in {}.'.format(checkpoint_directory))
     checkpoint = tf.train.Checkpoint(encoder=encoder, decoder=decoder)
-    checkpoint.restore(tf.train.latest_checkpoint(checkpoint_directory))
+    restore_status = checkpoint.restore(latest_checkpoint)
+    # Creates all the variables, and checks that each of them was restored from the checkpoint, so that a checkpoint
+    # saved with a different layout of the model raises an error instead of leaving variables randomly initialized.
+    try:
+        build_encoder_decoder(encoder, decoder, parameters)
+        restore_status.assert_existing_objects_matched()
+    except (AssertionError, tf.errors.InvalidArgumentError, ValueError) as error:
+        raise ValueError('The checkpoint {} does not match the layout of the {} model {}, and the model has to be '
+                         'retrained.'.format(latest_checkpoint, parameters['attention'], parameters['model_number'])
+                         ) from error
+    return encoder, decoder
+
+
+@tf.function(reduce_retracing=True)
+def generate_caption_indexes(image_features: tf.Tensor,
+                             encoder: tf.keras.Model,
+                             decoder: tf.keras.Model,
+                             start_token_index: int,
+                             end_token_index: int,
+                             rnn_size: int,
+                             maximum_length: int) -> tf.Tensor:
+    """Predicts the indexes of the caption for the images' extracted features in a single graph, so that the decoder
+    inputs and hidden states stay on the device across the timesteps.
+
+    Args:
+        image_features: The features extracted for the images using the pre-trained InceptionV3 model.
+        encoder: The restored encoder model for the current model configuration.
+        decoder: The restored decoder model for the current model configuration.
+        start_token_index: Index value for the start token in the vocabulary.
+        end_token_index: Index value for the end token in the vocabulary.
+        rnn_size: No. of units in each LSTM layer.
+        maximum_length: Maximum no. of indexes predicted for each caption.
+
+    Returns:
+        A tensor which contains the predicted indexes for the caption of each image.
+    """
+    batch_size = tf.shape(image_features)[0]
+    predicted_caption_indexes = tf.TensorArray(tf.int32, size=0, dynamic_size=True)
+    captions_completed = tf.zeros([batch_size], dtype=tf.bool)
     # Initializes the hidden states from the decoder for each batch.
-    decoder_hidden_states = decoder.initialize_hidden_states(1, parameters['rnn_size'])
+    decoder_hidden_states = decoder.initialize_hidden_states(batch_size, rnn_size)
     # First decoder input batch contains just the start token index.
-    decoder_input = tf.expand_dims([parameters['start_token_index']], 0)
+    decoder_input = tf.fill([batch_size, 1], start_token_index)
     encoder_out = encoder(image_features, False)
-    # Passes the encoder features into the decoder for all words in the captions.
-    for i in range(1, 100):
-        prediction, decoder_hidden_states = decoder(decoder_input, decoder_hidden_states, encoder_out, False)
-        predicted_id = tf.argmax(prediction[0]).numpy()
-        # Uses teacher forcing method to pass next target word as input into the decoder.
-        decoder_input = tf.expand_dims([predicted_id], 0)
-        predicted_caption_indexes.append(predicted_id)
-        if captions_tokenizer.vocab_size + 1 == predicted_id:
+    # Projects the encoder output for the attention layer once, as it does not change across the timesteps.
+    encoder_out_projected = decoder.precompute_attention(encoder_out)
+    # Passes the encoder features into the decoder until the end token is predicted for all the images.
+    for i in tf.range(maximum_length):
+        prediction, decoder_hidden_states = decoder(decoder_input, decoder_hidden_states, encoder_out,
+                                                    encoder_out_projected, False)
+        predicted_ids = tf.argmax(prediction, axis=-1, output_type=tf.int32)
+        predicted_caption_indexes = predicted_caption_indexes.write(i, predicted_ids)
+        captions_completed = tf.math.logical_or(captions_completed, tf.math.equal(predicted_ids, end_token_index))
+        if tf.reduce_all(captions_completed):
             break
-    predicted_caption_indexes = tf.convert_to_tensor(predicted_caption_indexes)
-    # Decodes the prediction captions by getting sub-tokens from the trained captions tokenizer
-    predicted_caption = captions_tokenizer.decode([i for i in predicted_caption_indexes.numpy()[1:-1]])
-    return predicted_caption
+        # Passes the predicted ids as the input into the decoder for the next timestep.
+        decoder_input = tf.expand_dims(predicted_ids, 1)
+    # Converts the predicted indexes from (max_length, batch_size) to (batch_size, max_length).
+    return tf.transpose(predicted_caption_indexes.stack())
+
+
+def predict_captions(image_features: tf.Tensor,
+                     encoder: tf.keras.Model,
+                     decoder: tf.keras.Model,
+                     parameters: dict,
+                     captions_tokenizer: tfds.deprecated.text.SubwordTextEncoder) -> list:
+    """Predicts captions for the current batch of images' extracted features using the current model configuration.
+
+    Args:
+        image_features: The features extracted for the current batch of images using the pre-trained InceptionV3 model.
+        encoder: The restored encoder model for the current model configuration.
+        decoder: The restored decoder model for the current model configuration.
+        parameters: A dictionary which contains current model configuration details.
+        captions_tokenizer: A TFDS tokenizer trained on the captions in the trained dataset.
+
+    Returns:
+        A list which contains the predicted caption for each image in the current batch.
+    """
+    end_token_index = captions_tokenizer.vocab_size + 1
+    predicted_caption_indexes = generate_caption_indexes(image_features, encoder, decoder,
+                                                         parameters['start_token_index'], end_token_index,
+                                                         parameters['rnn_size'], 99)
+    predicted_captions = list()
+    for current_caption_indexes in predicted_caption_indexes.numpy():
+        # Truncates the indexes after the first end token, as the captions in a batch end at different timesteps.
+        end_token_positions = np.where(current_caption_indexes == end_token_index)[0]
+        if len(end_token_positions) != 0:
+            current_caption_indexes = current_caption_indexes[:end_token_positions[0] + 1]
+        # Decodes the prediction captions by getting sub-tokens from the trained captions tokenizer
+        predicted_captions.append(captions_tokenizer.decode([i for i in current_caption_indexes[1:-1]]))
+    return predicted_captions
+
+
+def caption_prediction_worker(attention: str,
+                              model: int,
+                              maximum_batch_size: int,
+                              batch_timeout: float) -> None:
+    """Predicts captions for the uploaded images in the queue, by combining the requests which arrive together into a
+    single batch for the encoder-decoder model.
+
+    Args:
+        attention: Name of the attention used by the application.
+        model: Number of the model used by the application.
+        maximum_batch_size: Maximum no. of images predicted in a single batch.
+        batch_timeout: Time in seconds for which requests are collected after the first request in a batch.
+
+    Returns:
+        None.
+    """
+    try:
+        # Loads the InceptionV3 model pre-trained on Imagenet dataset, the tokenizer, and the trained encoder-decoder
+        # once.
+        feature_extractor_model = tf.keras.applications.InceptionV3(include_top=False, weights='imagenet')
+        parameters = load_json_file('results/{}/model_{}/utils'.format(attention, model), 'parameters')
+        captions_tokenizer = tfds.deprecated.text.SubwordTextEncoder.load_from_file(
+            'results/utils/captions_tokenizer')
+        encoder, decoder = restore_encoder_decoder(parameters)
+        # Traces the caption generation graph once for any batch size. The encoder and decoder steps inside it are
+        # compiled using XLA for each batch size, hence captions are predicted for blank images of every batch size up
+        # to the maximum, so that the first requests of any batch size do not wait for the compilation of the model.
+        image_features_spec = tf.TensorSpec((None, 64, 2048), dtype=feature_extractor_model.compute_dtype)
+        generate_caption_indexes.get_concrete_function(image_features_spec, encoder, decoder,
+                                                       parameters['start_token_index'],
+                                                       captions_tokenizer.vocab_size + 1, parameters['rnn_size'], 99)
+        for batch_size in range(1, maximum_batch_size + 1):
+            predict_captions(extract_image_features(tf.zeros((batch_size, 299, 299, 3)), feature_extractor_model),
+                             encoder, decoder, parameters, captions_tokenizer)
+    except Exception as error:
+        # Fails the current and future requests with the error, as the captions cannot be predicted without the models.
+        app.logger.exception('Caption prediction worker could not load the models.')
+        while True:
+            caption_requests.get()[1].set_exception(error)
+    while True:
+        # Waits for the first request, and collects the requests which arrive before the batch timeout.
+        batch_requests = [caption_requests.get()]
+        batch_end_time = time.time() + batch_timeout
+        while len(batch_requests) < maximum_batch_size:
+            try:
+                batch_requests.append(caption_requests.get(timeout=max(batch_end_time - time.time(), 0)))
+            except queue.Empty:
+                break
+        # Reads and pre-processes each image, and fails only the requests whose images could not be read.
+        images, image_requests = list(), list()
+        for image_path, predicted_caption_future in batch_requests:
+            try:
+                images.append(preprocess_image(image_path))
+                image_requests.append(predicted_caption_future)
+            except Exception as error:
+                predicted_caption_future.set_exception(error)
+        if len(images) == 0:
+            continue
+        try:
+            # Extracts the features for all the images in the batch using a single call to the InceptionV3 model.
+            extracted_features = extract_image_features(tf.stack(images), feature_extractor_model)
+            predicted_captions = predict_captions(extracted_features, encoder, decoder, parameters,
+                                                  captions_tokenizer)
+            for predicted_caption_future, predicted_caption in zip(image_requests, predicted_captions):
+                predicted_caption_future.set_result(predicted_caption)
+        except Exception as error:
+            for predicted_caption_future in image_requests:
+                predicted_caption_future.set_exception(error)
 
 
 @app.route('/index', methods=['POST'])
@@ -168,18 +336,19 @@ def image_upload():
     if not os.path.isdir(directory_path):
         os.mkdir(directory_path)
     uploaded_file = request.files['upload_file']
-    attention = 'luong_attention'
-    model = 2
     # Saves the uploaded in the server's designated location.
     if uploaded_file.filename != '':
         image_path = 'data/images/{}'.format(uploaded_file.filename)
         uploaded_file.save('data/images/{}'.format(uploaded_file.filename))
-        # Loads the InceptionV3 model pre-trained on Imagenet dataset.
-        feature_extractor_model = tf.keras.applications.InceptionV3(include_top=False, weights='imagenet')
-        extracted_features = preprocess_image(image_path, feature_extractor_model)
-        parameters = load_json_file('results/{}/model_{}/utils'.format(attention, model), 'parameters')
-        captions_tokenizer = tfds.deprecated.text.SubwordTextEncoder.load_from_file('results/utils/captions_tokenizer')
-        predicted_caption = predict_caption(extracted_features, parameters, captions_tokenizer)
+        # Queues the uploaded image for the prediction worker, and waits for its predicted caption. Renders the error
+        # page if the caption could not be predicted, or is not predicted within the time limit.
+        predicted_caption_future = Future()
+        caption_requests.put((image_path, predicted_caption_future))
+        try:
+            predicted_caption = predicted_caption_future.result(timeout=caption_request_timeout)
+        except Exception:
+            app.logger.exception('Caption could not be predicted for {}.'.format(image_path))
+            return render_template('error.html')
         return render_template('complete.html', image_name=uploaded_file.filename, caption=predicted_caption)
     else:
         return render_template('error.html')
@@ -211,5 +380,11 @@ def index():
     return render_template("index.html")
 
 
+# Starts the prediction worker with the model used by the application. The application should be served by a single
+# process with multiple threads (e.g., gunicorn --workers 1 --threads 8 app:app), so that the concurrent requests are
+# predicted together in the worker's batches.
+threading.Thread(target=caption_prediction_worker, args=('luong_attention', 2, 16, 0.05), daemon=True).start()
+
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run(threaded=True)
@@ -21,11 +21,14 @@ class Encoder(tf.keras.Model):
         self.dense_layer = tf.keras.layers.Dense(embedding_size, activation='relu')
         self.dropout_layer = tf.keras.layers.Dropout(rate=dropout_rate)
 
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def call(self, x: tf.Tensor,
              training: bool) -> tf.Tensor:
         """Input tensor is passed through the layers in the encoder model."""
         x = self.dense_layer(x)
-        x = self.dropout_layer(x, training=training)
+        # Dropout is only added to the graph while training, as it is an identity during inference.
+        if training:
+            x = self.dropout_layer(x, training=True)
         return x
 
 
@@ -35,33 +38,44 @@ class BahdanauAttention(tf.keras.Model):
 
     Args:
         w_1: Weights for the Encoder's output
-        w_2: Weights for the Encoder's hidden state h.
-        w_3: Weights for the Encoder's hidden state c.
-        v: Final layer which sums output from w_1, w_2, & w_3.
+        w_2: Weights for the concatenated hidden states h & c.
+        v: Final layer which sums output from w_1, & w_2.
     """
 
     def __init__(self, dense_size: int) -> None:
         """Initializes the layers in the instance based on the dense size"""
         super(BahdanauAttention, self).__init__()
         self.w_1 = tf.keras.layers.Dense(dense_size)
-        self.w_2 = tf.keras.layers.Dense(dense_size)
-        self.w_3 = tf.keras.layers.Dense(dense_size)
+        # Bias of w_1 is added to the projections of both the encoder output and the hidden states, hence w_2 does not
+        # use a bias.
+        self.w_2 = tf.keras.layers.Dense(dense_size, use_bias=False)
         self.v = tf.keras.layers.Dense(1)
 
+    @tf.function(jit_compile=True, reduce_retracing=True)
+    def precompute(self, encoder_out: tf.Tensor) -> tf.Tensor:
+        """Encoder output is passed through w_1 once per caption, as it does not change across the timesteps."""
+        return self.w_1(encoder_out)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def call(self, encoder_out: tf.Tensor,
+             encoder_out_projected: tf.Tensor,
              hidden_state_h: tf.Tensor,
              hidden_state_c: tf.Tensor) -> tf.Tensor:
-        """Encoder output, and hidden states are passed through the layers in the Bahdanau Attention model."""
-        # Inserts a length 1 at axis 1 in the hidden states.
-        hidden_state_h_time = tf.expand_dims(hidden_state_h, 1)
-        hidden_state_c_time = tf.expand_dims(hidden_state_c, 1)
+        """Encoder output, projected encoder output, and hidden states are passed through the layers in the Bahdanau
+        Attention model."""
+        # Concatenates the hidden states, so that h & c are projected by a single matrix multiplication, and inserts a
+        # length 1 at axis 1.
+        hidden_states_time = tf.expand_dims(tf.concat([hidden_state_h, hidden_state_c], axis=-1), 1)
         # Provides un-normalized score for each feature.
-        attention_hidden_layer = self.v(tf.nn.tanh(self.w_1(encoder_out) + self.w_2(hidden_state_h_time) +
-                                                   self.w_3(hidden_state_c_time)))
-        # Uses softmax on output from attention_hidden_layer to predict the output.
-        attention_out = tf.nn.softmax(attention_hidden_layer, axis=1)
-        context_vector = attention_out * encoder_out
-        context_vector = tf.reduce_sum(context_vector, axis=1)
+        attention_hidden_layer = self.v(tf.nn.tanh(encoder_out_projected + self.w_2(hidden_states_time)))
+        # Uses softmax on output from attention_hidden_layer to predict the output. The normalization of the softmax is
+        # deferred to the weighted sum, so that the scores are reduced in a single pass over the features.
+        attention_out = tf.math.exp(attention_hidden_layer - tf.reduce_max(attention_hidden_layer, axis=1,
+                                                                           keepdims=True))
+        # Contracts the scores with the encoder output over the 64 features using a batched matrix multiplication,
+        # instead of multiplying them element-wise and reducing the product.
+        context_vector = tf.squeeze(tf.matmul(attention_out, encoder_out, transpose_a=True), 1) / tf.reduce_sum(
+            attention_out, axis=1)
         return context_vector
 
 
@@ -73,8 +87,8 @@ class BahdanauDecoder1(tf.keras.Model):
         attention_layer: Bahdanau attention model which is used to emphasize the important features at different
                          timesteps.
         embedding_layer: Converts indexes from target vocabulary into dense vectors of fixed size.
-        rnn_layer: A Long Short-Term Memory layer used to learn dependencies in the given sequence.
-        dense_layer: Fully connected layer which encodes output sequence from the rnn layer to the target vocab size.
+        rnn_cell: A Long Short-Term Memory cell used to learn dependencies in the given sequence.
+        dense_layer: Fully connected layer which encodes output from the rnn cell to the target vocab size.
         dropout_layer: Dropout layer which prevents the model from overfitting on the training dataset.
     """
 
@@ -87,33 +101,44 @@ class BahdanauDecoder1(tf.keras.Model):
         super(BahdanauDecoder1, self).__init__()
         self.attention_layer = BahdanauAttention(rnn_size)
         self.embedding_layer = tf.keras.layers.Embedding(target_vocab_size, embedding_size)
-        self.rnn_layer = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
-        self.dense_layer = tf.keras.layers.Dense(target_vocab_size)
+        self.rnn_cell = tf.keras.layers.LSTMCell(rnn_size)
+        # Output layer is kept in float32, so that the logits are numerically stable when mixed precision is used.
+        self.dense_layer = tf.keras.layers.Dense(target_vocab_size, dtype='float32')
         self.dropout_layer = tf.keras.layers.Dropout(rate=dropout_rate)
 
+    def precompute_attention(self, encoder_out: tf.Tensor) -> tf.Tensor:
+        """Projects the encoder output for the attention layer once per caption."""
+        return self.attention_layer.precompute(encoder_out)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def call(self, x: tf.Tensor,
              hidden_states: list,
              encoder_out: tf.Tensor,
+             encoder_out_projected: tf.Tensor,
              training: bool) -> tuple:
-        """Input for current timestep, encoder output, and hidden states are passed through the layers in the decoder
-        model"""
-        context_vector = self.attention_layer(encoder_out, hidden_states[0], hidden_states[1])
-        x = self.embedding_layer(x)
+        """Input for current timestep, encoder output, projected encoder output, and hidden states are passed through
+        the layers in the decoder model"""
+        context_vector = self.attention_layer(encoder_out, encoder_out_projected, hidden_states[0], hidden_states[1])
+        # Removes the timestep axis from the embedding output, as the decoder is called for one timestep at a time.
+        x = tf.squeeze(self.embedding_layer(x), 1)
+        # Cells start from zero states in each timestep, as the hidden states from the previous timestep are used by
+        # the attention layer.
+        zero_states = self.rnn_cell.get_initial_state(batch_size=tf.shape(x)[0], dtype=x.dtype)
         # Concatenates context vector with embedding output.
-        x = tf.concat([tf.expand_dims(context_vector, 1), x], axis=-1)
-        x, hidden_state_h, hidden_state_c = self.rnn_layer(x)
-        x = self.dropout_layer(x, training=training)
-        # Reshape current output to (batch_size * max_length, hidden_size).
-        x = tf.reshape(x, (-1, x.shape[2]))
+        x = tf.concat([context_vector, x], axis=-1)
+        x, [hidden_state_h, hidden_state_c] = self.rnn_cell(x, zero_states)
+        # Dropout is only added to the graph while training, as it is an identity during inference.
+        if training:
+            x = self.dropout_layer(x, training=True)
         x = self.dense_layer(x)
         return x, [hidden_state_h, hidden_state_c]
 
     def initialize_hidden_states(self, batch_size: int,
                                  rnn_size: int) -> list:
-        """Initializes hidden states h & c in the RNN layer for each batch."""
-        hidden_state_h = tf.zeros((batch_size, rnn_size))
-        hidden_state_c = tf.zeros((batch_size, rnn_size))
-        return [hidden_state_h, hidden_state_c]
+        """Initializes hidden states h & c in the RNN layer for each batch, in the compute dtype of the decoder."""
+        # As tensors are immutable, a single zero tensor is allocated and used for both h & c.
+        hidden_state = tf.zeros((batch_size, rnn_size), dtype=self.compute_dtype)
+        return [hidden_state, hidden_state]
 
 
 class BahdanauDecoder2(tf.keras.Model):
@@ -124,9 +149,9 @@ class BahdanauDecoder2(tf.keras.Model):
         attention_layer: Bahdanau attention model which is used to emphasize the important features at different
                          timesteps.
         embedding_layer: Converts indexes from target vocabulary into dense vectors of fixed size.
-        rnn_layer_1: A Long Short-Term Memory layer used to learn dependencies in the given sequence.
-        rnn_layer_2: A Long Short-Term Memory layer used to learn dependencies in the given sequence.
-        dense_layer: Fully connected layer which encodes output sequence from the rnn layer to the target vocab size.
+        rnn_cell_1: A Long Short-Term Memory cell used to learn dependencies in the given sequence.
+        rnn_cell_2: A Long Short-Term Memory cell used to learn dependencies in the given sequence.
+        dense_layer: Fully connected layer which encodes output from the rnn cell to the target vocab size.
         dropout_layer: Dropout layer which prevents the model from overfitting on the training dataset.
     """
 
@@ -139,38 +164,50 @@ class BahdanauDecoder2(tf.keras.Model):
         super(BahdanauDecoder2, self).__init__()
         self.attention_layer = BahdanauAttention(rnn_size)
         self.embedding_layer = tf.keras.layers.Embedding(target_vocab_size, embedding_size)
-        self.rnn_layer_1 = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
-        self.rnn_layer_2 = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
-        self.dense_layer = tf.keras.layers.Dense(target_vocab_size)
+        self.rnn_cell_1 = tf.keras.layers.LSTMCell(rnn_size)
+        self.rnn_cell_2 = tf.keras.layers.LSTMCell(rnn_size)
+        # Output layer is kept in float32, so that the logits are numerically stable when mixed precision is used.
+        self.dense_layer = tf.keras.layers.Dense(target_vocab_size, dtype='float32')
         self.dropout_layer = tf.keras.layers.Dropout(rate=dropout_rate)
 
+    def precompute_attention(self, encoder_out: tf.Tensor) -> tf.Tensor:
+        """Projects the encoder output for the attention layer once per caption."""
+        return self.attention_layer.precompute(encoder_out)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def call(self, x: tf.Tensor,
              hidden_states: list,
              encoder_out: tf.Tensor,
+             encoder_out_projected: tf.Tensor,
              training: bool) -> tuple:
-        """Input for current timestep, encoder output, and hidden states are passed through the layers in the decoder
-        model"""
-        context_vector = self.attention_layer(encoder_out, hidden_states[0], hidden_states[1])
-        x = self.embedding_layer(x)
+        """Input for current timestep, encoder output, projected encoder output, and hidden states are passed through
+        the layers in the decoder model"""
+        context_vector = self.attention_layer(encoder_out, encoder_out_projected, hidden_states[0], hidden_states[1])
+        # Removes the timestep axis from the embedding output, as the decoder is called for one timestep at a time.
+        x = tf.squeeze(self.embedding_layer(x), 1)
+        # Cells start from zero states in each timestep, as the hidden states from the previous timestep are used by
+        # the attention layer.
+        zero_states = self.rnn_cell_1.get_initial_state(batch_size=tf.shape(x)[0], dtype=x.dtype)
         # Concatenates context vector with embedding output.
-        x = tf.concat([tf.expand_dims(context_vector, 1), x], axis=-1)
-        x, hidden_state_h, hidden_state_c = self.rnn_layer_1(x)
-        x = self.dropout_layer(x, training=training)
-        # Concatenates context vector with rnn_layer_1 output.
-        x = tf.concat([tf.expand_dims(context_vector, 1), x], axis=-1)
-        x, hidden_state_h, hidden_state_c = self.rnn_layer_2(x)
-        x = self.dropout_layer(x, training=training)
-        # Reshape current output to (batch_size * max_length, hidden_size).
-        x = tf.reshape(x, (-1, x.shape[2]))
+        x = tf.concat([context_vector, x], axis=-1)
+        x, [hidden_state_h, hidden_state_c] = self.rnn_cell_1(x, zero_states)
+        # Dropout is only added to the graph while training, as it is an identity during inference.
+        if training:
+            x = self.dropout_layer(x, training=True)
+        # Concatenates context vector with rnn_cell_1 output.
+        x = tf.concat([context_vector, x], axis=-1)
+        x, [hidden_state_h, hidden_state_c] = self.rnn_cell_2(x, zero_states)
+        if training:
+            x = self.dropout_layer(x, training=True)
         x = self.dense_layer(x)
         return x, [hidden_state_h, hidden_state_c]
 
     def initialize_hidden_states(self, batch_size: int,
                                  rnn_size: int) -> list:
-        """Initializes hidden states h & c in the RNN layer for each batch."""
-        hidden_state_h = tf.zeros((batch_size, rnn_size))
-        hidden_state_c = tf.zeros((batch_size, rnn_size))
-        return [hidden_state_h, hidden_state_c]
+        """Initializes hidden states h & c in the RNN layer for each batch, in the compute dtype of the decoder."""
+        # As tensors are immutable, a single zero tensor is allocated and used for both h & c.
+        hidden_state = tf.zeros((batch_size, rnn_size), dtype=self.compute_dtype)
+        return [hidden_state, hidden_state]
 
 
 class BahdanauDecoder3(tf.keras.Model):
@@ -181,10 +218,10 @@ class BahdanauDecoder3(tf.keras.Model):
         attention_layer: Bahdanau attention model which is used to emphasize the important features at different
                          timesteps.
         embedding_layer: Converts indexes from target vocabulary into dense vectors of fixed size.
-        rnn_layer_1: A Long Short-Term Memory layer used to learn dependencies in the given sequence.
-        rnn_layer_2: A Long Short-Term Memory layer used to learn dependencies in the given sequence.
-        rnn_layer_3: A Long Short-Term Memory layer used to learn dependencies in the given sequence.
-        dense_layer: Fully connected layer which encodes output sequence from the rnn layer to the target vocab size.
+        rnn_cell_1: A Long Short-Term Memory cell used to learn dependencies in the given sequence.
+        rnn_cell_2: A Long Short-Term Memory cell used to learn dependencies in the given sequence.
+        rnn_cell_3: A Long Short-Term Memory cell used to learn dependencies in the given sequence.
+        dense_layer: Fully connected layer which encodes output from the rnn cell to the target vocab size.
         dropout_layer: Dropout layer which prevents the model from overfitting on the training dataset.
     """
 
@@ -197,40 +234,53 @@ class BahdanauDecoder3(tf.keras.Model):
         super(BahdanauDecoder3, self).__init__()
         self.attention_layer = BahdanauAttention(rnn_size)
         self.embedding_layer = tf.keras.layers.Embedding(target_vocab_size, embedding_size)
-        self.rnn_layer_1 = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
-        self.rnn_layer_2 = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
-        self.rnn_layer_3 = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
-        self.dense_layer = tf.keras.layers.Dense(target_vocab_size)
+        self.rnn_cell_1 = tf.keras.layers.LSTMCell(rnn_size)
+        self.rnn_cell_2 = tf.keras.layers.LSTMCell(rnn_size)
+        self.rnn_cell_3 = tf.keras.layers.LSTMCell(rnn_size)
+        # Output layer is kept in float32, so that the logits are numerically stable when mixed precision is used.
+        self.dense_layer = tf.keras.layers.Dense(target_vocab_size, dtype='float32')
         self.dropout_layer = tf.keras.layers.Dropout(rate=dropout_rate)
 
+    def precompute_attention(self, encoder_out: tf.Tensor) -> tf.Tensor:
+        """Projects the encoder output for the attention layer once per caption."""
+        return self.attention_layer.precompute(encoder_out)
+
+    @tf.function(jit_compile=True, reduce_retracing=True)
     def call(self, x: tf.Tensor,
              hidden_states: list,
              encoder_out: tf.Tensor,
+             encoder_out_projected: tf.Tensor,
              training: bool) -> tuple:
-        """Input for current timestep, encoder output, and hidden states are passed through the layers in the decoder
-        model"""
-        context_vector = self.attention_layer(encoder_out, hidden_states[0], hidden_states[1])
-        x = self.embedding_layer(x)
+        """Input for current timestep, encoder output, projected encoder output, and hidden states are passed through
+        the layers in the decoder model"""
+        context_vector = self.attention_layer(encoder_out, encoder_out_projected, hidden_states[0], hidden_states[1])
+        # Removes the timestep axis from the embedding output, as the decoder is called for one timestep at a time.
+        x = tf.squeeze(self.embedding_layer(x), 1)
+        # Cells start from zero states in each timestep, as the hidden states from the previous timestep are used by
+        # the attention layer.
+        zero_states = self.rnn_cell_1.get_initial_state(batch_size=tf.shape(x)[0], dtype=x.dtype)
         # Concatenates context vector with embedding output.
-        x = tf.concat([tf.expand_dims(context_vector, 1), x], axis=-1)
-        x, hidden_state_h, hidden_state_c = self.rnn_layer_1(x)
-        x = self.dropout_layer(x, training=training)
-        # Concatenates context vector with rnn_layer_1 output.
-        x = tf.concat([tf.expand_dims(context_vector, 1), x], axis=-1)
-        x, hidden_state_h, hidden_state_c = self.rnn_layer_2(x)
-        x = self.dropout_layer(x, training=training)
-        # Concatenates context vector with rnn_layer_2 output.
-        x = tf.concat([tf.expand_dims(context_vector, 1), x], axis=-1)
-        x, hidden_state_h, hidden_state_c = self.rnn_layer_3(x)
-        x = self.dropout_layer(x, training=training)
-        # Reshape current output to (batch_size * max_length, hidden_size).
-        x = tf.reshape(x, (-1, x.shape[2]))
+        x = tf.concat([context_vector, x], axis=-1)
+        x, [hidden_state_h, hidden_state_c] = self.rnn_cell_1(x, zero_states)
+        # Dropout is only added to the graph while training, as it is an identity during inference.
+        if training:
+            x = self.dropout_layer(x, training=True)
+        # Concatenates context vector with rnn_cell_1 output.
+        x = tf.concat([context_vector, x], axis=-1)
+        x, [hidden_state_h, hidden_state_c] = self.rnn_cell_2(x, zero_states)
+        if training:
+            x = self.dropout_layer(x, training=True)
+        # Concatenates context vector with rnn_cell_2 output.
+        x = tf.concat([context_vector, x], axis=-1)
+        x, [hidden_state_h, hidden_state_c] = self.rnn_cell_3(x, zero_states)
+        if training:
+            x = self.dropout_layer(x, training=True)
         x = self.dense_layer(x)
         return x, [hidden_state_h, hidden_state_c]
 
     def initialize_hidden_states(self, batch_size: int,
                                  rnn_size: int) -> list:
-        """Initializes hidden states h & c in the RNN layer for each batch."""
-        hidden_state_h = tf.zeros((batch_size, rnn_size))
-        hidden_state_c = tf.zeros((batch_size, rnn_size))
-        return [hidden_state_h, hidden_state_c]
+        """Initializes hidden states h & c in the RNN layer for each batch, in the compute dtype of the decoder."""
+        # As tensors are immutable, a single zero tensor is allocated and used for both h & c.
+        hidden_state = tf.zeros((batch_size, rnn_size), dtype=self.compute_dtype)
+        return [hidden_state, hidden_state]
@@ -19,10 +19,16 @@ class LuongAttention(tf.keras.Model):
         super(LuongAttention, self).__init__()
         self.w_a = tf.keras.layers.Dense(dense_size)
 
+    def precompute(self, encoder_out: tf.Tensor) -> tf.Tensor:
+        """Encoder output is passed through w_a once per caption, as it does not change across the timesteps."""
+        return self.w_a(encoder_out)
+
     def call(self, encoder_out: tf.Tensor,
+             encoder_out_projected: tf.Tensor,
              decoder_out: tf.Tensor) -> tf.Tensor:
-        """Encoder output, and decoder output are passed through the layers in the Luong Attention model."""
-        attention_hidden_layer = tf.matmul(decoder_out, self.w_a(encoder_out), transpose_b=True)
+        """Encoder output, projected encoder output, and decoder output are passed through the layers in the Luong
+        Attention model."""
+        attention_hidden_layer = tf.matmul(decoder_out, encoder_out_projected, transpose_b=True)
         attention_out = tf.nn.softmax(attention_hidden_layer, axis=2)
         context_vector = tf.matmul(attention_out, encoder_out)
         return context_vector
@@ -55,31 +61,40 @@ class LuongDecoder1(tf.keras.Model):
         self.rnn_layer = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
         self.dense_layer_1 = tf.keras.layers.Dense(rnn_size, activation='tanh')
         self.dropout_layer = tf.keras.layers.Dropout(rate=dropout_rate)
-        self.dense_layer_2 = tf.keras.layers.Dense(target_vocab_size)
+        # Output layer is kept in float32, so that the logits are numerically stable when mixed precision is used.
+        self.dense_layer_2 = tf.keras.layers.Dense(target_vocab_size, dtype='float32')
+
+    def precompute_attention(self, encoder_out: tf.Tensor) -> tf.Tensor:
+        """Projects the encoder output for the attention layer once per caption."""
+        return self.attention_layer.precompute(encoder_out)
 
     def call(self, x: tf.Tensor,
              hidden_states: list,
              encoder_out: tf.Tensor,
+             encoder_out_projected: tf.Tensor,
              training: bool) -> tuple:
-        """Input for current timestep, encoder output, and hidden states are passed through the layers in the decoder
-        model"""
+        """Input for current timestep, encoder output, projected encoder output, and hidden states are passed through
+        the layers in the decoder model"""
         x = self.embedding_layer(x)
         x, h, c = self.rnn_layer(x, initial_state=hidden_states)
-        x = self.dropout_layer(x, training=training)
-        context_vector = self.attention_layer(encoder_out, x)
+        # Dropout is only added to the graph while training, as it is an identity during inference.
+        if training:
+            x = self.dropout_layer(x, training=True)
+        context_vector = self.attention_layer(encoder_out, encoder_out_projected, x)
         # Concatenates context vector and output from rnn_layer after reducing dimension in axis 1.
         x = tf.concat([tf.squeeze(context_vector, 1), tf.squeeze(x, 1)], 1)
         x = self.dense_layer_1(x)
-        x = self.dropout_layer(x, training=training)
+        if training:
+            x = self.dropout_layer(x, training=True)
         x = self.dense_layer_2(x)
         return x, [h, c]
 
     def initialize_hidden_states(self, batch_size: int,
                                  rnn_size: int) -> list:
-        """Initializes hidden states h & c in the RNN layer for each batch."""
-        hidden_state_h = tf.zeros((batch_size, rnn_size))
-        hidden_state_c = tf.zeros((batch_size, rnn_size))
-        return [hidden_state_h, hidden_state_c]
+        """Initializes hidden states h & c in the RNN layer for each batch, in the compute dtype of the decoder."""
+        # As tensors are immutable, a single zero tensor is allocated and used for both h & c.
+        hidden_state = tf.zeros((batch_size, rnn_size), dtype=self.compute_dtype)
+        return [hidden_state, hidden_state]
 
 
 class LuongDecoder2(tf.keras.Model):
@@ -111,33 +126,43 @@ class LuongDecoder2(tf.keras.Model):
         self.rnn_layer_2 = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
         self.dense_layer_1 = tf.keras.layers.Dense(rnn_size, activation='tanh')
         self.dropout_layer = tf.keras.layers.Dropout(rate=dropout_rate)
-        self.dense_layer_2 = tf.keras.layers.Dense(target_vocab_size)
+        # Output layer is kept in float32, so that the logits are numerically stable when mixed precision is used.
+        self.dense_layer_2 = tf.keras.layers.Dense(target_vocab_size, dtype='float32')
+
+    def precompute_attention(self, encoder_out: tf.Tensor) -> tf.Tensor:
+        """Projects the encoder output for the attention layer once per caption."""
+        return self.attention_layer.precompute(encoder_out)
 
     def call(self, x: tf.Tensor,
              hidden_states: list,
              encoder_out: tf.Tensor,
+             encoder_out_projected: tf.Tensor,
              training: bool) -> tuple:
-        """Input for current timestep, encoder output, and hidden states are passed through the layers in the decoder
-        model"""
+        """Input for current timestep, encoder output, projected encoder output, and hidden states are passed through
+        the layers in the decoder model"""
         x = self.embedding_layer(x)
         x, h, c = self.rnn_layer_1(x, initial_state=hidden_states)
-        x = self.dropout_layer(x, training=training)
+        # Dropout is only added to the graph while training, as it is an identity during inference.
+        if training:
+            x = self.dropout_layer(x, training=True)
         x, h, c = self.rnn_layer_2(x, initial_state=[h, c])
-        x = self.dropout_layer(x, training=training)
-        context_vector = self.attention_layer(encoder_out, x)
+        if training:
+            x = self.dropout_layer(x, training=True)
+        context_vector = self.attention_layer(encoder_out, encoder_out_projected, x)
         # Concatenates context vector and output from rnn_layer after reducing dimension in axis 1.
         x = tf.concat([tf.squeeze(context_vector, 1), tf.squeeze(x, 1)], 1)
         x = self.dense_layer_1(x)
-        x = self.dropout_layer(x, training=training)
+        if training:
+            x = self.dropout_layer(x, training=True)
         x = self.dense_layer_2(x)
         return x, [h, c]
 
     def initialize_hidden_states(self, batch_size: int,
                                  rnn_size: int) -> list:
-        """Initializes hidden states h & c in the RNN layer for each batch."""
-        hidden_state_h = tf.zeros((batch_size, rnn_size))
-        hidden_state_c = tf.zeros((batch_size, rnn_size))
-        return [hidden_state_h, hidden_state_c]
+        """Initializes hidden states h & c in the RNN layer for each batch, in the compute dtype of the decoder."""
+        # As tensors are immutable, a single zero tensor is allocated and used for both h & c.
+        hidden_state = tf.zeros((batch_size, rnn_size), dtype=self.compute_dtype)
+        return [hidden_state, hidden_state]
 
 
 class LuongDecoder3(tf.keras.Model):
@@ -171,32 +196,43 @@ class LuongDecoder3(tf.keras.Model):
         self.rnn_layer_3 = tf.keras.layers.LSTM(rnn_size, return_state=True, return_sequences=True)
         self.dense_layer_1 = tf.keras.layers.Dense(rnn_size, activation='tanh')
         self.dropout_layer = tf.keras.layers.Dropout(rate=dropout_rate)
-        self.dense_layer_2 = tf.keras.layers.Dense(target_vocab_size)
+        # Output layer is kept in float32, so that the logits are numerically stable when mixed precision is used.
+        self.dense_layer_2 = tf.keras.layers.Dense(target_vocab_size, dtype='float32')
+
+    def precompute_attention(self, encoder_out: tf.Tensor) -> tf.Tensor:
+        """Projects the encoder output for the attention layer once per caption."""
+        return self.attention_layer.precompute(encoder_out)
 
     def call(self, x: tf.Tensor,
              hidden_states: list,
              encoder_out: tf.Tensor,
+             encoder_out_projected: tf.Tensor,
              training: bool) -> tuple:
-        """Input for current timestep, encoder output, and hidden states are passed through the layers in the decoder
-        model"""
+        """Input for current timestep, encoder output, projected encoder output, and hidden states are passed through
+        the layers in the decoder model"""
         x = self.embedding_layer(x)
         x, h, c = self.rnn_layer_1(x, initial_state=hidden_states)
-        x = self.dropout_layer(x, training=training)
+        # Dropout is only added to the graph while training, as it is an identity during inference.
+        if training:
+            x = self.dropout_layer(x, training=True)
         x, h, c = self.rnn_layer_2(x, initial_state=[h, c])
-        x = self.dropout_layer(x, training=training)
+        if training:
+            x = self.dropout_layer(x, training=True)
         x, h, c = self.rnn_layer_3(x, initial_state=[h, c])
-        x = self.dropout_layer(x, training=training)
-        context_vector = self.attention_layer(encoder_out, x)
+        if training:
+            x = self.dropout_layer(x, training=True)
+        context_vector = self.attention_layer(encoder_out, encoder_out_projected, x)
         # Concatenates context vector and output from rnn_layer after reducing dimension in axis 1.
         x = tf.concat([tf.squeeze(context_vector, 1), tf.squeeze(x, 1)], 1)
         x = self.dense_layer_1(x)
-        x = self.dropout_layer(x, training=training)
+        if training:
+            x = self.dropout_layer(x, training=True)
         x = self.dense_layer_2(x)
         return x, [h, c]
 
     def initialize_hidden_states(self, batch_size: int,
                                  rnn_size: int) -> list:
-        """Initializes hidden states h & c in the RNN layer for each batch."""
-        hidden_state_h = tf.zeros((batch_size, rnn_size))
-        hidden_state_c = tf.zeros((batch_size, rnn_size))
-        return [hidden_state_h, hidden_state_c]
+        """Initializes hidden states h & c in the RNN layer for each batch, in the compute dtype of the decoder."""
+        # As tensors are immutable, a single zero tensor is allocated and used for both h & c.
+        hidden_state = tf.zeros((batch_size, rnn_size), dtype=self.compute_dtype)
+        return [hidden_state, hidden_state]
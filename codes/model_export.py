@@ -0,0 +1,195 @@
+# authors_name = 'Preetham Ganesh'
+# project_title = 'Captioning of Images using Attention Mechanism'
+# email = 'preetham.ganesh2015@gmail.com'
+
+
+import os
+import sys
+
+import tensorflow as tf
+import logging
+
+from utils import load_json_file
+from utils import restore_encoder_decoder
+from utils import check_directory_existence
+
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+logging.getLogger('tensorflow').setLevel(logging.FATAL)
+physical_devices = tf.config.list_physical_devices('GPU')
+tf.config.experimental.set_memory_growth(physical_devices[0], enable=True)
+
+
+def decoder_step_signature(parameters: dict) -> list:
+    """Creates the input signature of the decoder for a single timestep of a single image.
+
+    Args:
+        parameters: A dictionary which contains current model configuration details.
+
+    Returns:
+        A list which contains the tensor specs for the decoder input, hidden states h & c, encoder output, and
+        projected encoder output.
+    """
+    return [tf.TensorSpec((1, 1), tf.int32, name='decoder_input'),
+            tf.TensorSpec((1, parameters['rnn_size']), tf.float32, name='hidden_state_h'),
+            tf.TensorSpec((1, parameters['rnn_size']), tf.float32, name='hidden_state_c'),
+            tf.TensorSpec((1, 64, parameters['embedding_size']), tf.float32, name='encoder_out'),
+            tf.TensorSpec((1, 64, parameters['rnn_size']), tf.float32, name='encoder_out_projected')]
+
+
+def encoder_signature() -> list:
+    """Creates the input signature of the encoder for a single image.
+
+    Returns:
+        A list which contains the tensor spec for the features extracted using the pre-trained InceptionV3 model.
+    """
+    return [tf.TensorSpec((1, 64, 2048), tf.float32, name='image_features')]
+
+
+def decoder_step_function(decoder: tf.keras.Model,
+                          parameters: dict) -> tf.types.experimental.ConcreteFunction:
+    """Traces the decoder for a single timestep of a single image into a concrete function.
+
+    Args:
+        decoder: The restored decoder model for the current model configuration.
+        parameters: A dictionary which contains current model configuration details.
+
+    Returns:
+        The concrete function which predicts the output, and the hidden states for the current timestep.
+    """
+    @tf.function(input_signature=decoder_step_signature(parameters))
+    def decoder_step(decoder_input: tf.Tensor,
+                     hidden_state_h: tf.Tensor,
+                     hidden_state_c: tf.Tensor,
+                     encoder_out: tf.Tensor,
+                     encoder_out_projected: tf.Tensor) -> dict:
+        prediction, decoder_hidden_states = decoder(decoder_input, [hidden_state_h, hidden_state_c], encoder_out,
+                                                    encoder_out_projected, False)
+        return {'prediction': prediction, 'hidden_state_h': decoder_hidden_states[0],
+                'hidden_state_c': decoder_hidden_states[1]}
+    return decoder_step.get_concrete_function()
+
+
+def encoder_function(encoder: tf.keras.Model,
+                     decoder: tf.keras.Model) -> tf.types.experimental.ConcreteFunction:
+    """Traces the encoder and the projection of the encoder output for the attention layer, for a single image into a
+    concrete function.
+
+    Args:
+        encoder: The restored encoder model for the current model configuration.
+        decoder: The restored decoder model for the current model configuration.
+
+    Returns:
+        The concrete function which predicts the encoder output, and the projected encoder output.
+    """
+    @tf.function(input_signature=encoder_signature())
+    def encoder_step(image_features: tf.Tensor) -> dict:
+        encoder_out = encoder(image_features, False)
+        return {'encoder_out': encoder_out, 'encoder_out_projected': decoder.precompute_attention(encoder_out)}
+    return encoder_step.get_concrete_function()
+
+
+def export_saved_model(attention: str,
+                       model: str) -> str:
+    """Exports the encoder and the decoder step of the current model configuration as a SavedModel with fixed shape
+    signatures for a single image.
+
+    Args:
+        attention: Name of the current attention.
+        model: Name of the current model.
+
+    Returns:
+        A string which contains the path to the exported SavedModel.
+    """
+    model_directory_path = '../results/{}/model_{}'.format(attention, model)
+    parameters = load_json_file('{}/utils'.format(model_directory_path), 'parameters')
+    encoder, decoder = restore_encoder_decoder(parameters)
+    encoder_decoder = tf.Module()
+    encoder_decoder.encoder = encoder
+    encoder_decoder.decoder = decoder
+    saved_model_path = '{}/saved_model'.format(check_directory_existence(model_directory_path, 'exports'))
+    tf.saved_model.save(encoder_decoder, saved_model_path, signatures={
+        'encoder': encoder_function(encoder, decoder), 'decoder_step': decoder_step_function(decoder, parameters)})
+    print('Exported SavedModel for {} model_{} at {}.'.format(attention, model, saved_model_path))
+    print()
+    return saved_model_path
+
+
+def export_tensorrt(attention: str,
+                    model: str) -> None:
+    """Converts the signatures in the exported SavedModel of the current model configuration into TensorRT engines
+    with FP16 precision.
+
+    Args:
+        attention: Name of the current attention.
+        model: Name of the current model.
+
+    Returns:
+        None.
+    """
+    saved_model_path = export_saved_model(attention, model)
+    parameters = load_json_file('../results/{}/model_{}/utils'.format(attention, model), 'parameters')
+    directory_path = check_directory_existence('../results/{}/model_{}/exports'.format(attention, model), 'tensorrt')
+    signatures = {'encoder': encoder_signature(), 'decoder_step': decoder_step_signature(parameters)}
+    for signature_key, signature in signatures.items():
+        converter = tf.experimental.tensorrt.Converter(
+            input_saved_model_dir=saved_model_path, input_saved_model_signature_key=signature_key,
+            conversion_params=tf.experimental.tensorrt.ConversionParams(precision_mode='FP16'))
+        converter.convert()
+
+        def input_fn():
+            # Builds the TensorRT engines for the fixed shapes used during inference.
+            yield tuple(tf.zeros(tensor_spec.shape, dtype=tensor_spec.dtype) for tensor_spec in signature)
+        converter.build(input_fn=input_fn)
+        converter.save('{}/{}'.format(directory_path, signature_key))
+        print('Converted {} signature into TensorRT engine at {}/{}.'.format(signature_key, directory_path,
+                                                                              signature_key))
+    print()
+
+
+def export_quantized_decoder(attention: str,
+                             model: str) -> None:
+    """Exports the decoder of the current model configuration as a TFLite model with weights quantized to int8.
+
+    Args:
+        attention: Name of the current attention.
+        model: Name of the current model.
+
+    Returns:
+        None.
+    """
+    model_directory_path = '../results/{}/model_{}'.format(attention, model)
+    parameters = load_json_file('{}/utils'.format(model_directory_path), 'parameters')
+    encoder, decoder = restore_encoder_decoder(parameters)
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([decoder_step_function(decoder, parameters)],
+                                                                decoder)
+    # Dynamic range quantization stores the weights of the LSTM and dense layers in int8, and the hybrid kernels
+    # quantize the activations on the fly to use int8 matrix multiplications.
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    quantized_decoder = converter.convert()
+    directory_path = check_directory_existence(model_directory_path, 'exports')
+    with open('{}/decoder_step.tflite'.format(directory_path), 'wb') as in_file:
+        in_file.write(quantized_decoder)
+    print('Exported quantized decoder for {} model_{} at {}.'.format(attention, model, directory_path))
+    print()
+
+
+def main():
+    print()
+    attention = sys.argv[1]
+    model = sys.argv[2]
+    export_format = sys.argv[3]
+    if export_format == 'tflite':
+        export_quantized_decoder(attention, model)
+    elif export_format == 'saved_model':
+        export_saved_model(attention, model)
+    elif export_format == 'tensorrt':
+        export_tensorrt(attention, model)
+    else:
+        print('Argument for export format is not in the list of possible values.')
+        print()
+        sys.exit()
+
+
+if __name__ == '__main__':
+    main()
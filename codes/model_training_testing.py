@@ -60,7 +60,9 @@ def main():
     directory_path = check_directory_existence(directory_path, 'utils')
     save_json_file(parameters, directory_path, 'parameters')
     train_dataset = shuffle_slice_dataset(train_image_ids, train_captions, batch_size)
-    validation_dataset = shuffle_slice_dataset(validation_image_ids, validation_captions, batch_size)
+    # The validation dataset is used in every epoch, and its features are small enough to be kept in memory.
+    validation_dataset = shuffle_slice_dataset(validation_image_ids, validation_captions, batch_size,
+                                               preload_features=True)
     test_dataset = shuffle_slice_dataset(test_image_ids, test_captions, batch_size)
     print('Shuffled & Sliced the datasets.')
     print()
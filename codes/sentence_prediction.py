@@ -11,8 +11,9 @@ import tensorflow_datasets as tfds
 import logging
 import pandas as pd
 
-from utils import choose_encoder_decoder
+from utils import restore_encoder_decoder
 from utils import load_pickle_file
+from utils import load_image_features
 from utils import convert_dataset
 from utils import check_directory_existence
 from utils import load_json_file
@@ -22,46 +23,80 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 logging.getLogger('tensorflow').setLevel(logging.FATAL)
 physical_devices = tf.config.list_physical_devices('GPU')
 tf.config.experimental.set_memory_growth(physical_devices[0], enable=True)
+# Uses float16 computations with float32 variables for the inference of the encoder-decoder model on the GPU.
+tf.keras.mixed_precision.set_global_policy('mixed_float16')
+
+
+@tf.function(reduce_retracing=True)
+def generate_caption_indexes(image_features: tf.Tensor,
+                             encoder: tf.keras.Model,
+                             decoder: tf.keras.Model,
+                             start_token_index: int,
+                             end_token_index: int,
+                             rnn_size: int,
+                             maximum_length: int) -> tf.Tensor:
+    """Predicts the indexes of the caption for the images' extracted features in a single graph, so that the decoder
+    inputs and hidden states stay on the device across the timesteps.
+
+    Args:
+        image_features: The features extracted for the images using the pre-trained InceptionV3 model.
+        encoder: The restored encoder model for the current model configuration.
+        decoder: The restored decoder model for the current model configuration.
+        start_token_index: Index value for the start token in the vocabulary.
+        end_token_index: Index value for the end token in the vocabulary.
+        rnn_size: No. of units in each LSTM layer.
+        maximum_length: Maximum no. of indexes predicted for each caption.
+
+    Returns:
+        A tensor which contains the predicted indexes for the caption of each image.
+    """
+    batch_size = tf.shape(image_features)[0]
+    predicted_caption_indexes = tf.TensorArray(tf.int32, size=0, dynamic_size=True)
+    captions_completed = tf.zeros([batch_size], dtype=tf.bool)
+    # Initializes the hidden states from the decoder for each batch.
+    decoder_hidden_states = decoder.initialize_hidden_states(batch_size, rnn_size)
+    # First decoder input batch contains just the start token index.
+    decoder_input = tf.fill([batch_size, 1], start_token_index)
+    encoder_out = encoder(image_features, False)
+    # Projects the encoder output for the attention layer once, as it does not change across the timesteps.
+    encoder_out_projected = decoder.precompute_attention(encoder_out)
+    # Passes the encoder features into the decoder until the end token is predicted for all the images.
+    for i in tf.range(maximum_length):
+        prediction, decoder_hidden_states = decoder(decoder_input, decoder_hidden_states, encoder_out,
+                                                    encoder_out_projected, False)
+        predicted_ids = tf.argmax(prediction, axis=-1, output_type=tf.int32)
+        predicted_caption_indexes = predicted_caption_indexes.write(i, predicted_ids)
+        captions_completed = tf.math.logical_or(captions_completed, tf.math.equal(predicted_ids, end_token_index))
+        if tf.reduce_all(captions_completed):
+            break
+        # Passes the predicted ids as the input into the decoder for the next timestep.
+        decoder_input = tf.expand_dims(predicted_ids, 1)
+    # Converts the predicted indexes from (max_length, batch_size) to (batch_size, max_length).
+    return tf.transpose(predicted_caption_indexes.stack())
 
 
 def predict_caption(image_features: tf.Tensor,
+                    encoder: tf.keras.Model,
+                    decoder: tf.keras.Model,
                     parameters: dict,
                     captions_tokenizer: tfds.deprecated.text.SubwordTextEncoder) -> str:
     """Predicts caption for the current image's extracted features using the current model configuration.
 
     Args:
         image_features: The features extracted for the current image using the pre-trained InceptionV3 model.
+        encoder: The restored encoder model for the current model configuration.
+        decoder: The restored decoder model for the current model configuration.
         parameters: A dictionary which contains current model configuration details.
         captions_tokenizer: A TFDS tokenizer trained on the captions in the trained dataset.
 
     Returns:
         A string which contains the predicted caption for the current image.
     """
-    # Chooses the encoder and decoder based on the parameter configuration.
-    encoder, decoder = choose_encoder_decoder(parameters)
-    predicted_caption_indexes = []
-    # Creates checkpoint for the encoder-decoder model and restores the last saved checkpoint.
-    model_directory_path = '../results/{}/model_{}'.format(parameters['attention'], parameters['model_number'])
-    checkpoint_directory = '{}/checkpoints'.format(model_directory_path)
-    checkpoint = tf.train.Checkpoint(encoder=encoder, decoder=decoder)
-    checkpoint.restore(tf.train.latest_checkpoint(checkpoint_directory))
-    # Initializes the hidden states from the decoder for each batch.
-    decoder_hidden_states = decoder.initialize_hidden_states(1, parameters['rnn_size'])
-    # First decoder input batch contains just the start token index.
-    decoder_input = tf.expand_dims([parameters['start_token_index']], 0)
-    encoder_out = encoder(image_features, False)
-    # Passes the encoder features into the decoder for all words in the captions.
-    for i in range(1, 100):
-        prediction, decoder_hidden_states = decoder(decoder_input, decoder_hidden_states, encoder_out, False)
-        predicted_id = tf.argmax(prediction[0]).numpy()
-        # Uses teacher forcing method to pass next target word as input into the decoder.
-        decoder_input = tf.expand_dims([predicted_id], 0)
-        predicted_caption_indexes.append(predicted_id)
-        if captions_tokenizer.vocab_size + 1 == predicted_id:
-            break
-    predicted_caption_indexes = tf.convert_to_tensor(predicted_caption_indexes)
+    predicted_caption_indexes = generate_caption_indexes(image_features, encoder, decoder,
+                                                         parameters['start_token_index'],
+                                                         captions_tokenizer.vocab_size + 1, parameters['rnn_size'], 99)
     # Decodes the prediction captions by getting sub-tokens from the trained captions tokenizer
-    predicted_caption = captions_tokenizer.decode([i for i in predicted_caption_indexes.numpy()[1:-1]])
+    predicted_caption = captions_tokenizer.decode([i for i in predicted_caption_indexes.numpy()[0, 1:-1]])
     return predicted_caption
 
 
@@ -84,10 +119,13 @@ def predict_caption_dataset(attention: str,
     # Loads the trained tokenizer for the captions.
     captions_tokenizer = tfds.deprecated.text.SubwordTextEncoder.load_from_file(
         '../results/utils/captions_tokenizer')
-    current_data_split_predictions = pd.DataFrame(columns=['image_id', 'target_caption', 'predicted_caption'])
+    # Restores the encoder-decoder model once, so that the compiled graphs are reused across all the images.
+    encoder, decoder = restore_encoder_decoder(parameters)
+    current_data_split_predictions = list()
     for i in range(image_ids.shape[0]):
-        current_image_features = load_pickle_file('../data/processed_data/images', str(image_ids[i].numpy()))
-        current_predicted_caption = predict_caption(current_image_features, parameters, captions_tokenizer)
+        current_image_features = load_image_features(int(image_ids[i].numpy()))
+        current_predicted_caption = predict_caption(current_image_features, encoder, decoder, parameters,
+                                                    captions_tokenizer)
         current_target_caption_indexes = captions[i, :]
         # Decodes the prediction captions by getting sub-tokens from the trained captions tokenizer
         current_target_caption = captions_tokenizer.decode([j for j in current_target_caption_indexes[1:-1]
@@ -97,9 +135,11 @@ def predict_caption_dataset(attention: str,
         print('Predicted caption: {}'.format(current_predicted_caption))
         current_predictions = {'image_id': str(image_ids[i].numpy()), 'target_caption': current_target_caption,
                                'predicted_caption': current_predicted_caption}
-        current_data_split_predictions = current_data_split_predictions.append(current_predictions, ignore_index=True)
+        current_data_split_predictions.append(current_predictions)
         print()
     directory_path = check_directory_existence('../results/{}/model_{}'.format(attention, model), 'predictions')
+    current_data_split_predictions = pd.DataFrame(current_data_split_predictions,
+                                                  columns=['image_id', 'target_caption', 'predicted_caption'])
     current_data_split_predictions.to_csv('{}/{}.csv'.format(directory_path, data_split), index=False)
     print('Finished predicting captions for {} model_{} for the {} data.'.format(attention, model, data_split))
     print()
@@ -12,6 +12,7 @@ import json
 import numpy as np
 import pandas as pd
 import time
+import functools
 
 from bahdanau_attention_model import Encoder
 from bahdanau_attention_model import BahdanauDecoder1
@@ -36,7 +37,6 @@ def load_json_file(directory_path: str,
     file_path = '{}/{}.json'.format(directory_path, file_name)
     with open(file_path, 'r') as out_file:
         captions = json.load(out_file)
-    out_file.close()
     return captions
 
 
@@ -55,8 +55,7 @@ def save_pickle_file(file: np.ndarray or dict,
     """
     file_path = '{}/{}.pkl'.format(directory_path, file_name)
     with open(file_path, 'wb') as in_file:
-        pickle.dump(file, in_file, protocol=2)
-    in_file.close()
+        pickle.dump(file, in_file, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 def save_json_file(file: dict,
@@ -75,7 +74,6 @@ def save_json_file(file: dict,
     file_path = '{}/{}.json'.format(directory_path, file_name)
     with open(file_path, 'w') as in_file:
         json.dump(file, in_file, indent=4)
-    in_file.close()
 
 
 def load_pickle_file(directory_path: str,
@@ -92,10 +90,41 @@ def load_pickle_file(directory_path: str,
     file_path = '{}/{}.pkl'.format(directory_path, file_name)
     with open(file_path, 'rb') as out_file:
         dictionary = pickle.load(out_file)
-    out_file.close()
     return dictionary
 
 
+def save_numpy_file(file: np.ndarray,
+                    directory_path: str,
+                    file_name: str) -> None:
+    """Saves NumPy array into a NumPy file for future use.
+
+    Args:
+        file: NumPy array which needs to be saved.
+        directory_path: Path where the file needs to be saved.
+        file_name: Name by which the given file should be saved.
+
+    Returns:
+        None.
+    """
+    file_path = '{}/{}.npy'.format(directory_path, file_name)
+    np.save(file_path, file, allow_pickle=False)
+
+
+def load_numpy_file(directory_path: str,
+                    file_name: str) -> np.ndarray:
+    """Loads a NumPy file into memory based on the file_name.
+
+    Args:
+        directory_path: Path where the file is saved.
+        file_name: Name of the NumPy file which should be loaded.
+
+    Returns:
+        Loaded NumPy array.
+    """
+    file_path = '{}/{}.npy'.format(directory_path, file_name)
+    return np.load(file_path, allow_pickle=False)
+
+
 def convert_dataset(dataset: dict) -> tuple:
     """Filters captions with length less than or equal to 40. Converts current datasets into 2 tensors for image ids and
     captions. Pads tensors for captions to ensure uniform size.
@@ -106,17 +135,19 @@ def convert_dataset(dataset: dict) -> tuple:
     Returns:
         A tuple which contains tensors for image ids and captions.
     """
-    image_ids, captions = list(), list()
-    for i in range(len(dataset['captions'])):
-        # Checks if the length tokenized captions is less than or equal to 40.
-        if len(dataset['captions'][i]) <= 40:
-            image_ids.append(dataset['image_ids'][i])
-            captions.append(dataset['captions'][i])
-    # Converts modified list of image ids into a tensor.
-    image_ids = tf.convert_to_tensor(image_ids)
-    # Converts modified list of captions into a tensor, and pads 0 to the end of each item in the tensor if the length
-    # is less than 40.
-    captions = tf.keras.preprocessing.sequence.pad_sequences(captions, padding='post')
+    # Computes the length of the tokenized captions, and the indexes of the captions with length less than or equal to
+    # 40.
+    caption_lengths = np.fromiter((len(caption) for caption in dataset['captions']), dtype=np.int32,
+                                  count=len(dataset['captions']))
+    keep_indexes = np.flatnonzero(caption_lengths <= 40)
+    # Converts filtered image ids into an int32 tensor, as the COCO image ids are less than 2^31. The ids are cast
+    # back to int32, as np.asarray converts the list of Python integers into int64.
+    image_ids = tf.convert_to_tensor(np.asarray(dataset['image_ids'])[keep_indexes].astype(np.int32), dtype=tf.int32)
+    # Copies the filtered captions into an array of zeros, which pads 0 to the end of each caption if its length is less
+    # than the length of the longest filtered caption.
+    captions = np.zeros((keep_indexes.size, caption_lengths[keep_indexes].max(initial=0)), dtype=np.int32)
+    for row, i in enumerate(keep_indexes):
+        captions[row, :caption_lengths[i]] = dataset['captions'][i]
     return image_ids, captions
 
 
@@ -141,17 +172,74 @@ def check_directory_existence(directory_path: str,
 
 def shuffle_slice_dataset(image_ids: tf.Tensor,
                           captions: tf.Tensor,
-                          batch_size: int) -> tf.data.Dataset:
-    """Combines the tensors for the image ids and captions, shuffles them and slices them based on batch size.
+                          batch_size: int,
+                          preload_features: bool = False) -> tf.data.Dataset:
+    """Combines the tensors for the image ids and captions, shuffles them and slices them based on batch size. Loads the
+    extracted features for the image ids in each batch.
 
     Args:
         image_ids: Tensor which contains image ids for the current data split
         captions: Tensor which contains captions for the current data split.
         batch_size: Batch size for training the current model
+        preload_features: Whether the features saved for each image in the current data split should be loaded into
+                          memory once, instead of being loaded from the disk in every epoch. Not used when the
+                          consolidated features exist, as they are memory-mapped.
+
+    Returns:
+        A dataset which contains batches of extracted features and captions for the current data split.
     """
-    dataset = tf.data.Dataset.from_tensor_slices((image_ids, captions)).shuffle(len(image_ids))
-    dataset = dataset.batch(batch_size, drop_remainder=True)
-    return dataset
+    # Shuffles using a bounded buffer, so that the whole split is not held in the buffer, and reshuffles every epoch.
+    dataset = tf.data.Dataset.from_tensor_slices((image_ids, captions)).shuffle(
+        buffer_size=min(100000, len(image_ids)), reshuffle_each_iteration=True)
+    if load_consolidated_image_features() is not None:
+        dataset = dataset.batch(batch_size, drop_remainder=True)
+
+        def load_batch_features(batch_image_ids: tf.Tensor,
+                                batch_captions: tf.Tensor) -> tuple:
+            # Features are loaded in float16, and are cast by the encoder on the device.
+            batch_features = tf.numpy_function(image_features_retrieve, [batch_image_ids], tf.float16)
+            batch_features.set_shape([batch_size, 64, 2048])
+            return batch_features, batch_captions
+        # Gathers the features for the batches from the consolidated features in parallel.
+        dataset = dataset.map(load_batch_features, num_parallel_calls=tf.data.AUTOTUNE)
+    else:
+        features_retrieve = single_image_features_retrieve
+        if preload_features:
+            # Loads the features of each distinct image in the current data split once, as each image has multiple
+            # captions.
+            image_features = {image_id: single_image_features_retrieve(image_id) for image_id in
+                              np.unique(image_ids.numpy()).tolist()}
+
+            def features_retrieve(image_id: np.ndarray) -> np.ndarray:
+                return image_features[int(image_id)]
+
+        def load_features(image_id: tf.Tensor,
+                          caption: tf.Tensor) -> tf.data.Dataset:
+            # Features are loaded in float16, and are cast by the encoder on the device.
+            features = tf.numpy_function(features_retrieve, [image_id], tf.float16)
+            features.set_shape([64, 2048])
+            return tf.data.Dataset.from_tensors((features, caption))
+        # Reads the saved features of the images from 16 files concurrently, before they are sliced into batches.
+        dataset = dataset.interleave(load_features, cycle_length=16, num_parallel_calls=tf.data.AUTOTUNE)
+        dataset = dataset.batch(batch_size, drop_remainder=True)
+    # Prefetches the batches, so that the features for the next batches are loaded while the model is trained on the
+    # current batch.
+    dataset = dataset.prefetch(tf.data.AUTOTUNE)
+    # As the batches are shuffled, the order in which they are produced does not need to be deterministic. Enables the
+    # static optimizations of the pipeline, and a private thread pool with a thread for each CPU core.
+    options = tf.data.Options()
+    options.deterministic = False
+    options.experimental_optimization.map_and_batch_fusion = True
+    options.experimental_optimization.map_parallelization = True
+    options.experimental_optimization.parallel_batch = True
+    options.threading.private_threadpool_size = os.cpu_count()
+    return dataset.with_options(options)
+
+
+# Decoder classes for each attention and model number.
+decoders = {('bahdanau_attention', 1): BahdanauDecoder1, ('bahdanau_attention', 2): BahdanauDecoder2,
+            ('bahdanau_attention', 3): BahdanauDecoder3, ('luong_attention', 1): LuongDecoder1,
+            ('luong_attention', 2): LuongDecoder2, ('luong_attention', 3): LuongDecoder3}
 
 
 def choose_encoder_decoder(parameters) -> tuple:
@@ -163,53 +251,143 @@ def choose_encoder_decoder(parameters) -> tuple:
     Returns:
          A tuple which contains the objects for the encoder and decoder models
     """
-    encoder = Encoder(parameters['embedding_size'], parameters['dropout_rate'])
-    if parameters['attention'] == 'bahdanau_attention' and parameters['model_number'] == 1:
-        decoder = BahdanauDecoder1(parameters['embedding_size'], parameters['rnn_size'],
-                                   parameters['target_vocab_size'], parameters['dropout_rate'])
-    elif parameters['attention'] == 'bahdanau_attention' and parameters['model_number'] == 2:
-        decoder = BahdanauDecoder2(parameters['embedding_size'], parameters['rnn_size'],
-                                   parameters['target_vocab_size'], parameters['dropout_rate'])
-    elif parameters['attention'] == 'bahdanau_attention' and parameters['model_number'] == 3:
-        decoder = BahdanauDecoder3(parameters['embedding_size'], parameters['rnn_size'],
-                                   parameters['target_vocab_size'], parameters['dropout_rate'])
-    elif parameters['attention'] == 'luong_attention' and parameters['model_number'] == 1:
-        decoder = LuongDecoder1(parameters['embedding_size'], parameters['rnn_size'], parameters['dropout_rate'],
-                                parameters['target_vocab_size'])
-    elif parameters['attention'] == 'luong_attention' and parameters['model_number'] == 2:
-        decoder = LuongDecoder2(parameters['embedding_size'], parameters['rnn_size'], parameters['dropout_rate'],
-                                parameters['target_vocab_size'])
-    elif parameters['attention'] == 'luong_attention' and parameters['model_number'] == 3:
-        decoder = LuongDecoder3(parameters['embedding_size'], parameters['rnn_size'], parameters['dropout_rate'],
-                                parameters['target_vocab_size'])
-    else:
+    if (parameters['attention'], parameters['model_number']) not in decoders:
         print('Arguments for attention name or/and model number are not in the list of possible values.')
         print()
         sys.exit()
+    encoder = Encoder(parameters['embedding_size'], parameters['dropout_rate'])
+    # Passes the arguments by keyword, as the order of the arguments differs between the Bahdanau and Luong decoders.
+    decoder = decoders[(parameters['attention'], parameters['model_number'])](
+        embedding_size=parameters['embedding_size'], rnn_size=parameters['rnn_size'],
+        dropout_rate=parameters['dropout_rate'], target_vocab_size=parameters['target_vocab_size'])
+    return encoder, decoder
+
+
+def build_encoder_decoder(encoder: tf.keras.Model,
+                          decoder: tf.keras.Model,
+                          parameters: dict) -> None:
+    """Passes zero inputs through the encoder-decoder model once, so that all the variables are created and restored
+    from the checkpoint.
+
+    Args:
+        encoder: The encoder model for the current model configuration.
+        decoder: The decoder model for the current model configuration.
+        parameters: A dictionary which contains current model configuration details.
+
+    Returns:
+        None.
+    """
+    encoder_out = encoder(tf.zeros((1, 64, 2048)), False)
+    encoder_out_projected = decoder.precompute_attention(encoder_out)
+    decoder_hidden_states = decoder.initialize_hidden_states(1, parameters['rnn_size'])
+    decoder_input = tf.fill([1, 1], parameters['start_token_index'])
+    decoder(decoder_input, decoder_hidden_states, encoder_out, encoder_out_projected, False)
+
+
+def restore_encoder_decoder(parameters: dict) -> tuple:
+    """Chooses the encoder and decoder based on the parameter configuration, and restores the last saved checkpoint.
+
+    Args:
+        parameters: A dictionary which contains current model configuration details.
+
+    Returns:
+        A tuple which contains the objects for the restored encoder and decoder models.
+    """
+    encoder, decoder = choose_encoder_decoder(parameters)
+    # Creates checkpoint for the encoder-decoder model and restores the last saved checkpoint.
+    model_directory_path = '../results/{}/model_{}'.format(parameters['attention'], parameters['model_number'])
+    checkpoint_directory = '{}/checkpoints'.format(model_directory_path)
+    latest_checkpoint = tf.train.latest_checkpoint(checkpoint_directory)
+    if latest_checkpoint is None:
+        raise FileNotFoundError('No checkpoint found in {}.'.format(checkpoint_directory))
+    checkpoint = tf.train.Checkpoint(encoder=encoder, decoder=decoder)
+    restore_status = checkpoint.restore(latest_checkpoint)
+    # Creates all the variables, and checks that each of them was restored from the checkpoint, so that a checkpoint
+    # saved with a different layout of the model raises an error instead of leaving variables randomly initialized.
+    try:
+        build_encoder_decoder(encoder, decoder, parameters)
+        restore_status.assert_existing_objects_matched()
+    except (AssertionError, tf.errors.InvalidArgumentError, ValueError) as error:
+        raise ValueError('The checkpoint {} does not match the layout of the {} model {}, and the model has to be '
+                         'retrained.'.format(latest_checkpoint, parameters['attention'], parameters['model_number'])
+                         ) from error
     return encoder, decoder
 
 
+# Creates the loss object for the Sparse Categorical Crossentropy once, instead of at every timestep.
+loss_object = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True, reduction='none')
+
+
 def loss_function(actual_values: tf.Tensor,
                   predicted_values: tf.Tensor) -> tf.Tensor:
     """Computes the loss value for the current batch of the predicted values based on comparison with actual values.
 
     Args:
-        actual_values: Tensor which contains the actual values for the current batch.
-        predicted_values: Tensor which contains the predicted values for the current batch.
+        actual_values: Tensor which contains the actual values for all the timesteps in the current batch.
+        predicted_values: Tensor which contains the predicted values for all the timesteps in the current batch.
 
     Returns:
         Loss for the current batch.
     """
-    # Creates the loss object for the Sparse Categorical Crossentropy.
-    loss_object = tf.keras.losses.SparseCategoricalCrossentropy(from_logits=True, reduction='none')
     # Performs element-wise equality comparison and returns the truth values.
     mask = tf.math.logical_not(tf.math.equal(actual_values, 0))
-    # Computes loss for the current batch using actual values and predicted values.
+    # Computes loss for all the timesteps in the current batch using actual values and predicted values.
     current_loss = loss_object(actual_values, predicted_values)
     # Converts mask into the type the current loss belongs to.
     mask = tf.cast(mask, dtype=current_loss.dtype)
     current_loss *= mask
-    return tf.reduce_mean(current_loss)
+    # Sums the mean loss across the batch for each timestep.
+    return tf.reduce_sum(current_loss) / tf.cast(tf.shape(current_loss)[0], current_loss.dtype)
+
+
+def compute_loss_gradients(input_batch: tf.Tensor,
+                           target_batch: tf.Tensor,
+                           optimizer: tf.keras.optimizers.Optimizer,
+                           start_token_index: int,
+                           rnn_size: int,
+                           unroll_decoder: bool) -> tuple:
+    """Predicts the output for the current input batch, computes loss on comparison with the target batch, and computes
+    the gradients of the loss w.r.t. the variables of the encoder-decoder model.
+
+    Args:
+        input_batch: Current batch for the encoder model which contains the features extracted from the images.
+        target_batch: Current batch for the decoder model which contains the captions for the images.
+        optimizer: Optimizing algorithm wrapped with loss scaling, which will be used improve the performance of the
+            encoder-decoder model.
+        start_token_index: Index value for the start token in the vocabulary.
+        rnn_size: No. of units in each LSTM layer.
+        unroll_decoder: Whether the decoder is unrolled for each timestep into the graph, instead of iterating using a
+            graph loop.
+
+    Returns:
+        A tuple which contains the loss, and the gradients for the current batch.
+    """
+    # Initializes the hidden states from the decoder for each batch.
+    decoder_hidden_states = decoder.initialize_hidden_states(target_batch.shape[0], rnn_size)
+    # First decoder input batch contains just the start token index.
+    decoder_input_batch = tf.fill([target_batch.shape[0], 1], start_token_index)
+    predicted_batches = tf.TensorArray(tf.float32, size=target_batch.shape[1] - 1)
+    with tf.GradientTape() as tape:
+        encoder_out = encoder(input_batch, True)
+        # Projects the encoder output for the attention layer once, as it does not change across the timesteps.
+        encoder_out_projected = decoder.precompute_attention(encoder_out)
+        # Passes the encoder features into the decoder for all words in the captions. Iterates using a graph loop
+        # instead of unrolling the decoder for each timestep into the graph, unless the function is compiled using XLA,
+        # as XLA cannot compile the gradients of the concatenations inside a graph loop.
+        timesteps = range(1, target_batch.shape[1]) if unroll_decoder else tf.range(1, target_batch.shape[1])
+        for i in timesteps:
+            predicted_batch, decoder_hidden_states = decoder(decoder_input_batch, decoder_hidden_states, encoder_out,
+                                                             encoder_out_projected, True)
+            predicted_batches = predicted_batches.write(i - 1, predicted_batch)
+            # Uses teacher forcing method to pass next target word as input into the decoder.
+            decoder_input_batch = tf.expand_dims(target_batch[:, i], 1)
+        # Computes the loss for all the timesteps at once, from the predictions stacked into (batch, timesteps, vocab).
+        loss = loss_function(target_batch[:, 1:], tf.transpose(predicted_batches.stack(), [1, 0, 2]))
+        # Scales the loss, so that the small gradients computed in float16 do not underflow to zero.
+        scaled_loss = optimizer.get_scaled_loss(loss)
+    gradients = optimizer.get_unscaled_gradients(tape.gradient(scaled_loss, encoder.trainable_variables +
+                                                               decoder.trainable_variables))
+    return loss, gradients
 
 
 @tf.function
@@ -226,30 +404,18 @@ def train_step(input_batch: tf.Tensor,
     Args:
         input_batch: Current batch for the encoder model which contains the features extracted from the images.
         target_batch: Current batch for the decoder model which contains the captions for the images.
-        optimizer: Optimizing algorithm which will be used improve the performance of the encoder-decoder model.
+        optimizer: Optimizing algorithm wrapped with loss scaling, which will be used improve the performance of the
+            encoder-decoder model.
         start_token_index: Index value for the start token in the vocabulary.
         rnn_size: No. of units in each LSTM layer.
 
     Returns:
         None.
     """
-    loss = 0
-    # Initializes the hidden states from the decoder for each batch.
-    decoder_hidden_states = decoder.initialize_hidden_states(target_batch.shape[0], rnn_size)
-    # First decoder input batch contains just the start token index.
-    decoder_input_batch = tf.expand_dims([start_token_index] * target_batch.shape[0], 1)
-    with tf.GradientTape() as tape:
-        encoder_out = encoder(input_batch, True)
-        # Passes the encoder features into the decoder for all words in the captions.
-        for i in range(1, target_batch.shape[1]):
-            predicted_batch, decoder_hidden_states = decoder(decoder_input_batch, decoder_hidden_states, encoder_out,
-                                                             True)
-            loss += loss_function(target_batch[:, i], predicted_batch)
-            # Uses teacher forcing method to pass next target word as input into the decoder.
-            decoder_input_batch = tf.expand_dims(target_batch[:, i], 1)
-    model_variables = encoder.trainable_variables + decoder.trainable_variables
-    gradients = tape.gradient(loss, model_variables)
-    optimizer.apply_gradients(zip(gradients, model_variables))
+    loss, gradients = compiled_loss_gradients(input_batch, target_batch, optimizer, start_token_index, rnn_size)
+    # Applies the gradients outside of the compiled function, as the loss scaling optimizer skips the update using a
+    # conditional on whether the gradients are finite.
+    optimizer.apply_gradients(zip(gradients, encoder.trainable_variables + decoder.trainable_variables))
     batch_loss = (loss / target_batch.shape[1])
     train_loss(batch_loss)
 
@@ -269,40 +435,84 @@ def validation_step(input_batch: tf.Tensor,
     Returns:
         None.
     """
-    loss = 0
     # Initializes the hidden states from the decoder for each batch.
     decoder_hidden_states = decoder.initialize_hidden_states(target_batch.shape[0], rnn_size)
     # First decoder input batch contains just the start token index.
-    decoder_input_batch = tf.expand_dims([start_token_index] * target_batch.shape[0], 1)
+    decoder_input_batch = tf.fill([target_batch.shape[0], 1], start_token_index)
+    predicted_batches = tf.TensorArray(tf.float32, size=target_batch.shape[1] - 1)
     encoder_out = encoder(input_batch, False)
+    # Projects the encoder output for the attention layer once, as it does not change across the timesteps.
+    encoder_out_projected = decoder.precompute_attention(encoder_out)
     # Passes the encoder features into the decoder for all words in the captions.
     for i in range(1, target_batch.shape[1]):
-        predicted_batch, decoder_hidden_states = decoder(decoder_input_batch, decoder_hidden_states, encoder_out, False)
-        loss += loss_function(target_batch[:, i], predicted_batch)
+        predicted_batch, decoder_hidden_states = decoder(decoder_input_batch, decoder_hidden_states, encoder_out,
+                                                         encoder_out_projected, False)
+        predicted_batches = predicted_batches.write(i - 1, predicted_batch)
         decoder_input_batch = tf.expand_dims(target_batch[:, i], 1)
+    loss = loss_function(target_batch[:, 1:], tf.transpose(predicted_batches.stack(), [1, 0, 2]))
     batch_loss = loss / target_batch.shape[1]
     validation_loss(batch_loss)
 
 
-def image_features_retrieve(batch_image_ids: tf.Tensor) -> tf.Tensor:
-    """Retrieves saved extracted features for image ids in the batch.
+@functools.lru_cache(maxsize=None)
+def load_consolidated_image_features() -> tuple or None:
+    """Loads the consolidated features for all the images as a memory-mapped array, if they were saved during the
+    pre-processing of the dataset.
+
+    Returns:
+        A tuple which contains the memory-mapped features, and the dictionary which maps image ids to their rows, or
+        None if the consolidated features do not exist.
+    """
+    directory_path = '../data/processed_data/images'
+    if not os.path.isfile('{}/features.npy'.format(directory_path)):
+        return None
+    consolidated_features = np.load('{}/features.npy'.format(directory_path), mmap_mode='r')
+    image_id_rows = load_json_file(directory_path, 'features_rows')
+    return consolidated_features, image_id_rows
+
+
+def load_image_features(image_id: int) -> np.ndarray:
+    """Loads saved extracted features for the image id.
 
     Args:
-        batch_image_ids: A tensor which contains the image ids in the current batch.
+        image_id: An integer which contains the id of the current image.
 
     Returns:
-        A tensor which contains extracted features for the image ids in the current batch.
+        A NumPy array which contains extracted features for the current image.
     """
-    extracted_features = list()
-    # Iterates across the image ids in the current batch.
-    for i in range(len(batch_image_ids)):
-        current_image_features = load_pickle_file('../data/processed_data/images', str(batch_image_ids[i].numpy()))
-        extracted_features.append(current_image_features)
-    extracted_features = tf.convert_to_tensor(extracted_features)
-    # Reshapes the tensor from (batch_size, 1, 64, 2048) to (batch_size, 64, 2048).
-    extracted_features = tf.reshape(extracted_features, [extracted_features.shape[0], extracted_features.shape[2],
-                                                         extracted_features.shape[3]])
-    return extracted_features
+    directory_path = '../data/processed_data/images'
+    # Features extracted before they were saved as NumPy files are loaded from their pickle files.
+    if not os.path.isfile('{}/{}.npy'.format(directory_path, image_id)):
+        return load_pickle_file(directory_path, str(image_id))
+    return load_numpy_file(directory_path, str(image_id))
+
+
+def single_image_features_retrieve(image_id: np.ndarray) -> np.ndarray:
+    """Retrieves saved extracted features for the image id, from the features saved for each image.
+
+    Args:
+        image_id: A NumPy array which contains the id of the current image.
+
+    Returns:
+        A NumPy array which contains extracted features of shape (64, 2048) for the current image.
+    """
+    # Features extracted before they were stored in float16 are cast after they are loaded.
+    return load_image_features(int(image_id))[0].astype(np.float16, copy=False)
+
+
+def image_features_retrieve(batch_image_ids: np.ndarray) -> np.ndarray:
+    """Retrieves saved extracted features for image ids in the batch, from the consolidated features.
+
+    Args:
+        batch_image_ids: A NumPy array which contains the image ids in the current batch.
+
+    Returns:
+        A NumPy array which contains extracted features for the image ids in the current batch.
+    """
+    consolidated_features, image_id_rows = load_consolidated_image_features()
+    # Gathers the rows for the image ids in the current batch from the memory-mapped features in a single read.
+    rows = np.fromiter((image_id_rows[str(image_id)] for image_id in batch_image_ids), dtype=np.int64)
+    return consolidated_features[rows]
 
 
 def model_training_validation(train_dataset: tf.data.Dataset,
@@ -318,79 +528,95 @@ def model_training_validation(train_dataset: tf.data.Dataset,
     Returns:
         None.
     """
-    global encoder, decoder, train_loss, validation_loss
+    global encoder, decoder, train_loss, validation_loss, compiled_loss_gradients
     # Tensorflow metrics which computes the mean of all the elements.
     train_loss = tf.keras.metrics.Mean(name='train_loss')
     validation_loss = tf.keras.metrics.Mean(name='validation_loss')
+    # Uses float16 computations with float32 variables for training the encoder-decoder model on the GPU.
+    tf.keras.mixed_precision.set_global_policy('mixed_float16')
     # Chooses the encoder and decoder based on the parameter configuration.
     encoder, decoder = choose_encoder_decoder(parameters)
-    # Creates checkpoint and manager for the encoder-decoder model and the optimizer.
-    optimizer = tf.keras.optimizers.Adam()
+    # Compiles the unrolled decoder timesteps, the loss and the gradients using XLA for the Bahdanau models, so that the
+    # steps are fused into fewer kernels. The Luong models are not compiled, as XLA does not support their cuDNN LSTM
+    # layers, and iterate using a graph loop.
+    jit_compile = parameters['attention'] == 'bahdanau_attention'
+    compiled_loss_gradients = tf.function(functools.partial(compute_loss_gradients, unroll_decoder=jit_compile),
+                                          jit_compile=jit_compile)
+    # Creates checkpoint and manager for the encoder-decoder model and the optimizer. Wraps the optimizer with dynamic
+    # loss scaling for the float16 gradients.
+    optimizer = tf.keras.mixed_precision.LossScaleOptimizer(tf.keras.optimizers.Adam())
     model_directory_path = '../results/{}/model_{}'.format(parameters['attention'], parameters['model_number'])
     checkpoint_directory = '{}/checkpoints'.format(model_directory_path)
     checkpoint = tf.train.Checkpoint(optimizer=optimizer, encoder=encoder, decoder=decoder)
     manager = tf.train.CheckpointManager(checkpoint, directory=checkpoint_directory, max_to_keep=3)
-    # Creates empty dataframe for saving the model training and validation metrics for the current encoder-decoder
-    # model.
-    split_history_dataframe = pd.DataFrame(columns=['epochs', 'train_loss', 'validation_loss'])
+    # Creates empty list for saving the model training and validation metrics for each epoch of the current
+    # encoder-decoder model.
+    split_history = list()
     checkpoint_count = 0
     best_validation_loss = None
     history_directory_path = check_directory_existence(model_directory_path, 'history')
     history_dictionary_path = '{}/split_history.csv'.format(history_directory_path)
+    # Copies the batches to the GPU ahead of the train and validation steps. As prefetch to device has to be the final
+    # transformation, the no. of steps per epoch are taken before it.
+    train_dataset = train_dataset.take(parameters['train_steps_per_epoch']).apply(
+        tf.data.experimental.prefetch_to_device('/GPU:0', buffer_size=2))
+    validation_dataset = validation_dataset.take(parameters['validation_steps_per_epoch']).apply(
+        tf.data.experimental.prefetch_to_device('/GPU:0', buffer_size=2))
     # Iterates across the epochs for training the encoder-decoder model.
     print()
     for epoch in range(parameters['epochs']):
         epoch_start_time = time.time()
         train_loss.reset_states()
         validation_loss.reset_states()
-        # Iterates across the batches in the train dataset.
-        for (batch, (image_ids, target_batch)) in enumerate(train_dataset.take(parameters['train_steps_per_epoch'])):
-            batch_start_time = time.time()
-            # Loads features for the image ids in the current batch.
-            input_batch = image_features_retrieve(image_ids)
+        # Iterates across the batches in the train dataset. Reading the loss waits for the GPU to finish the queued
+        # steps, hence the loss, and the time taken for the batches since the last print are printed every 50 batches.
+        batches_start_time = time.time()
+        for (batch, (input_batch, target_batch)) in enumerate(train_dataset):
             train_step(input_batch, target_batch, optimizer, parameters['start_token_index'], parameters['rnn_size'])
-            batch_end_time = time.time()
-            if batch % 10 == 0:
+            if batch % 50 == 0:
+                batches_end_time = time.time()
                 print('Epoch={}, Batch={}, Training loss={}, Time taken={} sec'.format(
                     epoch + 1, batch, str(round(train_loss.result().numpy(), 3)),
-                    round(batch_end_time - batch_start_time, 3)))
+                    round(batches_end_time - batches_start_time, 3)))
+                batches_start_time = batches_end_time
         print()
         # Iterates across the batches in the validation dataset.
-        for (batch, (image_ids, target_batch)) in enumerate(validation_dataset.take(
-                parameters['validation_steps_per_epoch'])):
-            batch_start_time = time.time()
-            # Loads features for the image ids in the current batch.
-            input_batch = image_features_retrieve(image_ids)
+        batches_start_time = time.time()
+        for (batch, (input_batch, target_batch)) in enumerate(validation_dataset):
             validation_step(input_batch, target_batch, parameters['start_token_index'], parameters['rnn_size'])
-            batch_end_time = time.time()
-            if batch % 10 == 0:
+            if batch % 50 == 0:
+                batches_end_time = time.time()
                 print('Epoch={}, Batch={}, Validation loss={}, Time taken={} sec'.format(
                     epoch + 1, batch, str(round(validation_loss.result().numpy(), 3)),
-                    round(batch_end_time - batch_start_time, 3)))
+                    round(batches_end_time - batches_start_time, 3)))
+                batches_start_time = batches_end_time
         print()
-        # Updates the complete metrics dataframe with the metrics for the current training and validation metrics.
-        history_dictionary = {'epochs': int(epoch + 1), 'train_loss': str(round(train_loss.result().numpy(), 3)),
-                              'validation_loss': str(round(validation_loss.result().numpy(), 3))}
-        split_history_dataframe = split_history_dataframe.append(history_dictionary, ignore_index=True)
-        split_history_dataframe.to_csv(history_dictionary_path, index=False)
+        # Reads the training and validation loss for the current epoch from the GPU once.
+        epoch_train_loss = str(round(train_loss.result().numpy(), 3))
+        epoch_validation_loss = str(round(validation_loss.result().numpy(), 3))
+        # Updates the complete metrics list with the metrics for the current training and validation metrics, and saves
+        # the metrics for all the epochs so far.
+        history_dictionary = {'epochs': int(epoch + 1), 'train_loss': epoch_train_loss,
+                              'validation_loss': epoch_validation_loss}
+        split_history.append(history_dictionary)
+        pd.DataFrame(split_history, columns=['epochs', 'train_loss', 'validation_loss']).to_csv(
+            history_dictionary_path, index=False)
         epoch_end_time = time.time()
         print('Epoch={}, Training loss={}, Validation loss={}, Time taken={} sec'.format(
-            epoch + 1, str(round(train_loss.result().numpy(), 3)), str(round(validation_loss.result().numpy(), 3)),
-            round(epoch_end_time - epoch_start_time, 3)))
+            epoch + 1, epoch_train_loss, epoch_validation_loss, round(epoch_end_time - epoch_start_time, 3)))
         # If epoch = 1, then best validation loss is replaced with current validation loss, and the checkpoint is saved.
         if best_validation_loss is None:
             checkpoint_count = 0
-            best_validation_loss = str(round(validation_loss.result().numpy(), 3))
+            best_validation_loss = epoch_validation_loss
             manager.save()
             print('Checkpoint saved at {}'.format(checkpoint_directory))
             print()
         # If the best validation loss is higher than current validation loss, the best validation loss is replaced with
         # current validation loss, and the checkpoint is saved.
-        elif best_validation_loss > str(round(validation_loss.result().numpy(), 3)):
+        elif best_validation_loss > epoch_validation_loss:
             checkpoint_count = 0
-            print('Best validation loss changed from {} to {}'.format(str(best_validation_loss),
-                                                                      str(round(validation_loss.result().numpy(), 3))))
-            best_validation_loss = str(round(validation_loss.result().numpy(), 3))
+            print('Best validation loss changed from {} to {}'.format(str(best_validation_loss), epoch_validation_loss))
+            best_validation_loss = epoch_validation_loss
             manager.save()
             print('Checkpoint saved at {}'.format(checkpoint_directory))
             print()
@@ -419,19 +645,14 @@ def model_testing(test_dataset: tf.data.Dataset,
     Returns:
         None.
     """
-    global validation_loss
+    global encoder, decoder, validation_loss
     # Tensorflow metrics which computes the mean of all the elements.
     validation_loss = tf.keras.metrics.Mean(name='validation_loss')
     validation_loss.reset_states()
-    # Chooses the encoder and decoder based on the parameter configuration.
-    encoder, decoder = choose_encoder_decoder(parameters)
-    # Creates checkpoint for the encoder-decoder model and restores the last saved checkpoint.
-    model_directory_path = '../results/{}/model_{}'.format(parameters['attention'], parameters['model_number'])
-    checkpoint_directory = '{}/checkpoints'.format(model_directory_path)
-    checkpoint = tf.train.Checkpoint(encoder=encoder, decoder=decoder)
-    checkpoint.restore(tf.train.latest_checkpoint(checkpoint_directory))
+    # Chooses the encoder and decoder based on the parameter configuration, and restores the last saved checkpoint, so
+    # that the validation step tests the best saved model.
+    encoder, decoder = restore_encoder_decoder(parameters)
     # Iterates across the batches in the test dataset.
     for (batch, (input_batch, target_batch)) in enumerate(test_dataset.take(parameters['test_steps_per_epoch'])):
-        input_batch = image_features_retrieve(input_batch)
         validation_step(input_batch, target_batch, parameters['start_token_index'], parameters['rnn_size'])
     print('Test Loss={}'.format(str(round(validation_loss.result().numpy(), 3))))